@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+import sys
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': 'usertools-default.sqlite3',
+            },
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': 'usertools-replica.sqlite3',
+            },
+        },
+        INSTALLED_APPS=(
+            'django.contrib.admin',
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.messages',
+            'django.contrib.sessions',
+            'django.contrib.sites',
+            'guardian',
+            'usertools',
+        ),
+        AUTHENTICATION_BACKENDS=(
+            'usertools.backends.EmailAuthenticationBackend',
+            'guardian.backends.ObjectPermissionBackend',
+        ),
+        ANONYMOUS_USER_ID=-1,
+        SITE_ID=1,
+        USE_TZ=True,
+    )
+
+from django.test.utils import get_runner
+
+
+def runtests(*test_args):
+    if not test_args:
+        test_args = ['usertools']
+    TestRunner = get_runner(settings)
+    failures = TestRunner(verbosity=1, interactive=False).run_tests(test_args)
+    sys.exit(bool(failures))
+
+
+if __name__ == '__main__':
+    runtests(*sys.argv[1:])
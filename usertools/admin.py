@@ -3,9 +3,82 @@
 ###############################################################################
 # Django
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.mail import get_connection
+from django.db import connections
+from django.db.models import Q
+from django.db.models.query import QuerySet
 
 # User
 from usertools import models
+from usertools import settings as usertools_settings
+
+
+###############################################################################
+## Code
+###############################################################################
+# Number of verification emails handed to the mail backend at once.
+EMAIL_BATCH_SIZE = 100
+
+
+def estimate_count(model, using):
+    """
+    Returns the row count of ``model``'s table as estimated by the database
+    statistics, or ``None`` if the backend does not provide one.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [connection.ops.quote_name(table)])
+    elif connection.vendor == 'mysql':
+        cursor.execute('SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+    else:
+        return None
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountQuerySet(QuerySet):
+    """
+    QuerySet that answers ``count()`` on an unfiltered table from the
+    database statistics once the table is larger than
+    ``ADMIN_COUNT_ESTIMATE_THRESHOLD``. Filtered counts are always exact.
+    """
+    def count(self):
+        threshold = usertools_settings.ADMIN_COUNT_ESTIMATE_THRESHOLD
+        if (threshold is not None and self._result_cache is None
+                and not self.query.where and not self.query.low_mark
+                and self.query.high_mark is None):
+            estimate = estimate_count(self.model, self.db)
+            if estimate is not None and estimate > threshold:
+                return estimate
+        return super(EstimatedCountQuerySet, self).count()
+
+
+###############################################################################
+## Filters
+###############################################################################
+class PendingEmailChangeFilter(admin.SimpleListFilter):
+    title = 'pending email change'
+    parameter_name = 'pending_email_change'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        # ``email_unconfirmed`` is NULL for new users and '' once confirmed.
+        # A single range predicate excludes both and can use the index.
+        if self.value() == 'yes':
+            return queryset.filter(email_unconfirmed__gt='')
+        if self.value() == 'no':
+            return queryset.filter(Q(email_unconfirmed__isnull=True)
+                | Q(email_unconfirmed=''))
+        return queryset
 
 
 ###############################################################################
@@ -14,3 +87,79 @@ from usertools import models
 class UserToolsInline(admin.StackedInline):
     model = models.UserTools
     max_num = 1
+
+
+class UserToolsAdmin(admin.ModelAdmin):
+    """
+    Changelist for :class:`UserTools` that stays usable on large user tables.
+
+    All actions run as set-based ``UPDATE``s or stream the selection once, so
+    their cost does not depend on a query per selected row.
+    """
+    list_display = ('user', 'verified', 'email_unconfirmed',
+        'email_confirmation_key_created')
+    list_filter = ('verified', PendingEmailChangeFilter)
+    list_select_related = True
+    search_fields = ('=user__username', '=user__email')
+    raw_id_fields = ('user',)
+    actions = ('resend_verification', 'mark_verified',
+        'clear_pending_email_change')
+
+    def queryset(self, request):
+        qs = super(UserToolsAdmin, self).queryset(request)
+        return qs.select_related('user')._clone(klass=EstimatedCountQuerySet)
+
+    def get_actions(self, request):
+        # The default delete action collects and lists every selected object.
+        actions = super(UserToolsAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def resend_verification(self, request, queryset):
+        # Keys expire with ``date_joined``, ``verify_email`` would reject them.
+        queryset = queryset.filter(verified=False,
+            user__date_joined__gt=self.model.objects.expiration_date())
+        limit = usertools_settings.ADMIN_RESEND_LIMIT
+        if limit is not None and queryset.count() > limit:
+            self.message_user(request,
+                'Select at most %d users with an unexpired verification key, '
+                'no emails were sent.' % limit)
+            return
+
+        connection = get_connection()
+        connection.open()
+        batch, sent = [], 0
+        try:
+            for usertools in queryset.select_related('user').iterator():
+                batch.append(usertools.get_verification_email())
+                if len(batch) >= EMAIL_BATCH_SIZE:
+                    connection.send_messages(batch)
+                    sent += len(batch)
+                    batch = []
+            if batch:
+                connection.send_messages(batch)
+                sent += len(batch)
+        finally:
+            connection.close()
+        self.message_user(request,
+            'Sent %d verification email(s).' % sent)
+    resend_verification.short_description = 'Resend verification email'
+
+    def mark_verified(self, request, queryset):
+        users = User.objects.filter(
+            usertools__in=queryset.filter(verified=False))
+        updated = self.model.objects.mark_verified_bulk(users)
+        self.message_user(request,
+            'Marked %d user(s) as verified.' % updated)
+    mark_verified.short_description = 'Mark email as verified'
+
+    def clear_pending_email_change(self, request, queryset):
+        updated = queryset.filter(email_unconfirmed__gt='').update(
+            email_unconfirmed='', email_confirmation_key='',
+            email_confirmation_key_created=None)
+        self.message_user(request,
+            'Cleared %d pending email change(s).' % updated)
+    clear_pending_email_change.short_description = 'Clear pending email change'
+
+
+admin.site.register(models.UserTools, UserToolsAdmin)
@@ -4,7 +4,13 @@
 # Django
 from django.core.validators import email_re
 from django.contrib.auth.backends import ModelBackend
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, SiteProfileNotAvailable
+from django.db import models
+
+# User
+from usertools import settings as usertools_settings
+from usertools.models import UserTools
+from usertools.utils import get_profile_model, get_read_database, use_primary
 
 
 ###############################################################################
@@ -36,16 +42,19 @@ class EmailAuthenticationBackend(ModelBackend):
         :return: The signed in :class:`User`.
 
         """
+        users = User.objects.using(get_read_database(User))
         if email_re.search(identification):
             try:
-                user = User.objects.get(email__iexact=identification)
+                user = users.get(email__iexact=identification)
             except User.DoesNotExist:
                 return None
         else:
             try:
-                user = User.objects.get(username__iexact=identification)
+                user = users.get(username__iexact=identification)
             except User.DoesNotExist:
                 return None
+        # ``login`` saves the user, which must not go to the replica.
+        use_primary(user)
         if check_password:
             if user.check_password(password):
                 return user
@@ -54,7 +63,50 @@ class EmailAuthenticationBackend(ModelBackend):
             return user
 
     def get_user(self, user_id):
+        """
+        Returns the :class:`User` with ``user_id``.
+
+        With ``USERTOOLS_LOAD_USER_RELATED`` the user's :class:`UserTools`
+        and profile are loaded in the same query and cached on the user, so
+        ``user.usertools`` and ``user.get_profile()`` cost no query for as
+        long as the auth middleware keeps the user on the request.
+
+        """
+        users = User.objects.using(get_read_database(User))
+        related = []
+        if usertools_settings.LOAD_USER_RELATED:
+            related = self.get_user_related()
+            users = users.select_related(
+                *[rel.get_accessor_name() for rel in related])
         try:
-            return User.objects.get(pk=user_id)
+            user = users.get(pk=user_id)
         except User.DoesNotExist:
             return None
+
+        for rel in related:
+            rel_obj = getattr(user, rel.get_cache_name(), None)
+            if rel_obj is None:
+                # Let the accessor raise ``DoesNotExist`` as usual.
+                if hasattr(user, rel.get_cache_name()):
+                    delattr(user, rel.get_cache_name())
+                continue
+            use_primary(rel_obj)
+            if rel.model is not UserTools:
+                user._profile_cache = rel_obj
+        return use_primary(user)
+
+    def get_user_related(self):
+        """
+        Returns the reverse one-to-one relations from the user that
+        ``get_user`` follows: the :class:`UserTools` and, if it is linked
+        with a ``OneToOneField``, the profile.
+        """
+        related = [UserTools._meta.get_field('user').related]
+        try:
+            profile_model = get_profile_model()
+        except SiteProfileNotAvailable:
+            return related
+        field = profile_model._meta.get_field('user')
+        if isinstance(field, models.OneToOneField):
+            related.append(field.related)
+        return related
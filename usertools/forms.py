@@ -5,6 +5,9 @@
 from django import forms
 from django.contrib.auth.models import User
 
+# User
+from usertools.utils import email_change_allowed, get_read_database
+
 
 ###############################################################################
 ## Forms
@@ -33,8 +36,12 @@ class ChangeEmailForm(forms.Form):
         """
         if self.cleaned_data['email'].lower() == self.user.email:
             raise forms.ValidationError('This is already your email address.')
-        if User.objects.filter(email__iexact=self.cleaned_data['email'])\
-            .exclude(email__iexact=self.user.email):
+        if not email_change_allowed(self.user):
+            raise forms.ValidationError('Too many email change requests. '
+                'Please try again later.')
+        if User.objects.using(get_read_database(User))\
+            .filter(email__iexact=self.cleaned_data['email'])\
+            .exclude(email__iexact=self.user.email).exists():
             raise forms.ValidationError('This email address is already in use.')
         return self.cleaned_data['email']
 
@@ -0,0 +1,64 @@
+###############################################################################
+## Import Python
+###############################################################################
+import timeit
+from optparse import make_option
+
+
+###############################################################################
+## Import Django
+###############################################################################
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand, BaseCommand
+
+
+###############################################################################
+## Import User
+###############################################################################
+from usertools.keys import KeyGenerator
+from usertools.utils import generate_hash
+
+
+###############################################################################
+## Command
+###############################################################################
+class Command(NoArgsCommand):
+    """
+    Measures the cost per key of the key generation strategies: the legacy
+    hash, and the CSPRNG one key at a time and in batches.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--keys',
+            action='store',
+            type='int',
+            dest='keys',
+            default=100000,
+            help='Number of keys generated per strategy.'),
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=1000,
+            help='Number of keys per batch.'),
+        )
+
+    help = 'Benchmarks verification key generation.'
+
+    def handle_noargs(self, **options):
+        count, batch_size = options['keys'], options['batch_size']
+        user = User(username='benchmark')
+        generator = KeyGenerator()
+
+        # (name, number of calls, keys per call, function)
+        strategies = (
+            ('legacy', count, 1, lambda: generate_hash(user)),
+            ('random', count, 1, generator.generate),
+            ('random batch', max(count // batch_size, 1), batch_size,
+                lambda: generator.generate_batch(batch_size)),
+        )
+        for name, calls, keys_per_call, function in strategies:
+            seconds = timeit.timeit(function, number=calls)
+            keys = calls * keys_per_call
+            self.stdout.write("%-12s %8.2f us/key (%d keys)\n"
+                % (name, seconds / keys * 1e6, keys))
@@ -7,13 +7,17 @@ from optparse import make_option
 ###############################################################################
 ## Import Django
 ###############################################################################
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.management.base import NoArgsCommand, BaseCommand
 
 
 ###############################################################################
 ## Import User
 ###############################################################################
+from usertools.management.reporting import REPORT_OPTIONS, Reporter
 from usertools.models import UserTools
+from usertools.utils import get_read_database
 
 
 ###############################################################################
@@ -25,7 +29,7 @@ class Command(NoArgsCommand):
     This command checks that all permissions are correct.
 
     """
-    option_list = BaseCommand.option_list + (
+    option_list = BaseCommand.option_list + REPORT_OPTIONS + (
         make_option('--no-output',
             action='store_false',
             dest='output',
@@ -41,21 +45,35 @@ class Command(NoArgsCommand):
     help = 'Check that user permissions are correct.'
 
     def handle_noargs(self, **options):
-        permissions, users, warnings = UserTools.objects.check_permissions()
         output = options.pop("output")
         test = options.pop("test")
         if test:
             self.stdout.write(40 * ".")
             self.stdout.write("\nChecking permission management command. Ignore output..\n\n")
-        if output:
-            for p in permissions:
-                self.stdout.write("Added permission: %s\n" % p)
-
-            for u in users:
-                self.stdout.write("Changed permissions for user: %s\n" % u)
 
-            for w in warnings:
-                self.stdout.write("WARNING: %s\n" % w)
+        total = None
+        if output:
+            total = User.objects.using(get_read_database(User))\
+                .exclude(id=settings.ANONYMOUS_USER_ID).count()
+        reporter = Reporter.from_options(self, options, total=total,
+            verbose=output)
+        try:
+            for kind, value in UserTools.objects.iter_check_permissions():
+                if kind == 'checked':
+                    reporter.tick()
+                elif kind == 'permission':
+                    reporter.record(kind, "Added permission: %s" % value,
+                        name=value)
+                elif kind == 'changed':
+                    reporter.record(kind,
+                        "Changed permissions for user: %s" % value,
+                        id=value.pk, username=value.username)
+                elif kind == 'warning':
+                    reporter.record(kind, "WARNING: %s" % value,
+                        message=value)
+            reporter.finish()
+        finally:
+            reporter.close()
 
         if test:
             self.stdout.write("\nFinished testing permissions command.. continuing..\n")
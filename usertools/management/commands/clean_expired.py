@@ -1,13 +1,22 @@
+###############################################################################
+## Import Python
+###############################################################################
+from optparse import make_option
+
+
 ###############################################################################
 ## Import Django
 ###############################################################################
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import NoArgsCommand, BaseCommand
 
 
 ###############################################################################
 ## Inport User
 ###############################################################################
-from usertools.models import UserTools
+from usertools import settings as usertools_settings
+from usertools.management.reporting import REPORT_OPTIONS, Reporter
+from usertools.managers import BULK_CHUNK_SIZE
+from usertools.models import ExpiredUser, UserTools
 
 
 ###############################################################################
@@ -18,8 +27,68 @@ class Command(NoArgsCommand):
     Search for users that still haven't verified their email after
     ``VERIFICATION_DAYS`` and delete them.
 
+    In ``archive`` mode the users are deactivated and archived instead, and
+    deleted when the command runs with ``--purge``.
+
     """
+    option_list = BaseCommand.option_list + REPORT_OPTIONS + (
+        make_option('--mode',
+            action='store',
+            type='choice',
+            dest='mode',
+            choices=('delete', 'archive'),
+            default=usertools_settings.EXPIRY_MODE,
+            help='delete expired users, or archive them for a later purge.'),
+        make_option('--purge',
+            action='store_true',
+            dest='purge',
+            default=False,
+            help='Delete the users archived by earlier runs.'),
+        make_option('--rows-per-second',
+            action='store',
+            type='int',
+            dest='rows_per_second',
+            default=usertools_settings.PURGE_ROWS_PER_SECOND,
+            help='Maximum number of users deleted per second by --purge.'),
+        make_option('--batch-size',
+            action='store',
+            type='int',
+            dest='batch_size',
+            default=BULK_CHUNK_SIZE,
+            help='Number of users read or written per batch.'),
+        )
+
     help = 'Deletes expired users.'
 
     def handle_noargs(self, **options):
-        UserTools.objects.delete_expired_users()
+        if options['mode'] == 'archive':
+            pending = UserTools.objects.expired_unarchived()
+        else:
+            pending = UserTools.objects.expired()
+        reporter = Reporter.from_options(self, options, total=pending.count())
+        try:
+            if options['mode'] == 'archive':
+                archived = UserTools.objects.archive_expired_users(
+                    batch_size=options['batch_size'], progress=reporter.tick)
+                reporter.record('archived', "Archived %d user(s)." % archived,
+                    count=archived)
+            else:
+                for user in UserTools.objects.iter_delete_expired_users(
+                        batch_size=options['batch_size']):
+                    reporter.record('deleted', "Deleted user: %s" % user,
+                        username=user.username, email=user.email)
+                    reporter.tick()
+            reporter.finish()
+
+            if options['purge']:
+                reporter.start(
+                    total=ExpiredUser.objects.filter(purged=False).count())
+                purged = UserTools.objects.purge_expired_users(
+                    rows_per_second=options['rows_per_second'],
+                    batch_size=options['batch_size'],
+                    progress=reporter.tick)
+                reporter.record('purged', "Purged %d user(s)." % purged,
+                    count=purged)
+                reporter.finish()
+        finally:
+            reporter.close()
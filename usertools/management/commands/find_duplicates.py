@@ -0,0 +1,84 @@
+###############################################################################
+## Import Python
+###############################################################################
+from optparse import make_option
+
+
+###############################################################################
+## Import Django
+###############################################################################
+from django.core.management.base import NoArgsCommand, BaseCommand, CommandError
+from django.db import DatabaseError
+
+
+###############################################################################
+## Import User
+###############################################################################
+from usertools.management.reporting import REPORT_OPTIONS, Reporter
+from usertools.managers import IDENTITY_FIELDS
+from usertools.models import UserTools
+
+
+###############################################################################
+## Command
+###############################################################################
+class Command(NoArgsCommand):
+    """
+    Reports users whose email or username only differs in case. Such users
+    cannot log in with ``EmailAuthenticationBackend``.
+
+    With ``--create-index``, fields without duplicates get a unique index on
+    their lowercased value, so no new duplicates can be created.
+
+    """
+    option_list = BaseCommand.option_list + REPORT_OPTIONS + (
+        make_option('--field',
+            action='append',
+            type='choice',
+            dest='fields',
+            choices=IDENTITY_FIELDS,
+            help='Field to check, email or username. Defaults to both.'),
+        make_option('--create-index',
+            action='store_true',
+            dest='create_index',
+            default=False,
+            help='Add a case-insensitive unique index to fields without '
+                'duplicates.'),
+        )
+
+    help = 'Finds users with emails or usernames that only differ in case.'
+
+    def handle_noargs(self, **options):
+        reporter = Reporter.from_options(self, options)
+        try:
+            for field in options['fields'] or IDENTITY_FIELDS:
+                self.check_field(field, reporter, options['create_index'])
+        finally:
+            reporter.close()
+
+    def check_field(self, field, reporter, create_index):
+        reporter.start()
+        for identity, users in UserTools.objects.duplicate_identities(field):
+            reporter.record('duplicate', "Duplicate %s %s: %s" % (field,
+                identity, ', '.join('%s (%s)' % user for user in users)),
+                field=field, identity=identity,
+                users=[user_id for user_id, value in users])
+            reporter.tick()
+        conflicts = reporter.done
+        reporter.finish()
+
+        if create_index:
+            if conflicts:
+                self.stderr.write("Not indexing %s, resolve the %d "
+                    "duplicate(s) first.\n" % (field, conflicts))
+                return
+            try:
+                name, created = UserTools.objects.create_identity_index(field)
+            except (DatabaseError, NotImplementedError) as e:
+                raise CommandError('Cannot index %s: %s' % (field, e))
+            if created:
+                message = "Created index %s." % name
+            else:
+                message = "Index %s already exists." % name
+            reporter.record('index', message, field=field, name=name,
+                created=created)
@@ -0,0 +1,373 @@
+###############################################################################
+## Import Python
+###############################################################################
+import httplib
+import math
+import os
+import Queue
+import shutil
+import tempfile
+import threading
+import time
+from optparse import make_option
+from SocketServer import ThreadingMixIn
+
+
+###############################################################################
+## Import Django
+###############################################################################
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (WSGIServer, WSGIRequestHandler,
+    get_internal_wsgi_application)
+from django.core.urlresolvers import reverse, NoReverseMatch
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.timezone import now
+
+
+###############################################################################
+## Import User
+###############################################################################
+from usertools import settings as usertools_settings
+from usertools.backends import EmailAuthenticationBackend
+from usertools.keys import generate_keys
+from usertools.models import UserTools
+from usertools.utils import chunked
+
+
+###############################################################################
+## Code
+###############################################################################
+SCENARIOS = ('verify', 'confirm', 'login')
+# Lookups matching the UserTools whose key a scenario used successfully. The
+# views redirect on failure too, so the status code alone cannot tell.
+ACCEPTED = {
+    'verify': {'verified': True},
+    'confirm': {'email_confirmation_key': ''},
+}
+USERNAME_PREFIX = 'loadtest'
+PASSWORD = 'loadtest'
+QUERY_COUNT_HEADER = 'X-Usertools-Queries'
+# Small enough for SQLite's limit on query parameters.
+SEED_CHUNK_SIZE = 50
+
+
+def count_queries():
+    """
+    Returns the number of queries run so far by this thread's connections.
+    """
+    total = 0
+    for connection in connections.all():
+        connection.use_debug_cursor = True
+        total += len(connection.queries)
+    return total
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank ``percent`` percentile of ``values``.
+    """
+    ordered = sorted(values)
+    index = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[max(index, 0)]
+
+
+class QueryCountingApplication(object):
+    """
+    WSGI application wrapper that reports the number of queries each request
+    ran in the ``X-Usertools-Queries`` response header.
+    """
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        before = count_queries()
+
+        def counting_start_response(status, headers, exc_info=None):
+            headers = list(headers) + [
+                (QUERY_COUNT_HEADER, str(count_queries() - before))]
+            return start_response(status, headers, exc_info)
+
+        return self.application(environ, counting_start_response)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+###############################################################################
+## Command
+###############################################################################
+class Command(BaseCommand):
+    """
+    Measures the throughput and latency of the usertools endpoints.
+
+    Creates a test database, seeds it with users that have pending
+    verification and email confirmation keys, serves the project in-process
+    and drives ``usertools-verify`` and ``usertools-email-confirm`` over
+    HTTP with concurrent client threads. Logins are driven through
+    :class:`EmailAuthenticationBackend` directly, as usertools has no login
+    view. Fails if a given budget is exceeded.
+
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--users',
+            action='store',
+            type='int',
+            dest='users',
+            default=500,
+            help='Number of synthetic users, and of requests per scenario.'),
+        make_option('--concurrency',
+            action='store',
+            type='int',
+            dest='concurrency',
+            default=10,
+            help='Number of concurrent client threads.'),
+        make_option('--scenarios',
+            action='store',
+            dest='scenarios',
+            default=','.join(SCENARIOS),
+            help='Comma separated scenarios to run, of: %s.'
+                % ', '.join(SCENARIOS)),
+        make_option('--max-p50',
+            action='store',
+            type='float',
+            dest='max_p50',
+            help='Fail if the median latency exceeds this many ms.'),
+        make_option('--max-p99',
+            action='store',
+            type='float',
+            dest='max_p99',
+            help='Fail if the 99th percentile latency exceeds this many ms.'),
+        make_option('--min-rps',
+            action='store',
+            type='float',
+            dest='min_rps',
+            help='Fail if fewer requests per second are handled.'),
+        make_option('--max-queries',
+            action='store',
+            type='float',
+            dest='max_queries',
+            help='Fail if requests run more queries than this on average.'),
+        make_option('--noinput',
+            action='store_false',
+            dest='interactive',
+            default=True,
+            help='Do not prompt before replacing an existing test database.'),
+        )
+
+    help = 'Load tests the usertools verify, confirm and login paths.'
+
+    def handle(self, **options):
+        scenarios = [s.strip() for s in options['scenarios'].split(',')]
+        for scenario in scenarios:
+            if scenario not in SCENARIOS:
+                raise CommandError('Unknown scenario: %s' % scenario)
+        if options['users'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--users and --concurrency must be positive.')
+
+        # The seeded data only exists on the test database.
+        usertools_settings.READ_DATABASE = None
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        old_name = connection.settings_dict['NAME']
+        temp_dir = None
+        if (connection.vendor == 'sqlite'
+                and connection.settings_dict.get('TEST_NAME') in (None, '', ':memory:')):
+            # An in-memory database cannot be shared with the server threads.
+            temp_dir = tempfile.mkdtemp()
+            connection.settings_dict['TEST_NAME'] = os.path.join(temp_dir,
+                'loadtest.sqlite3')
+
+        try:
+            from south.management.commands import patch_for_test_db_setup
+        except ImportError:
+            pass
+        else:
+            # Without this, syncdb skips the tables of migrated apps.
+            patch_for_test_db_setup()
+
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0,
+            autoclobber=not options['interactive'])
+        try:
+            users = self.seed(options['users'])
+            server = self.start_server()
+            try:
+                violations = []
+                for scenario in scenarios:
+                    results, elapsed = self.run_scenario(
+                        getattr(self, 'request_%s' % scenario),
+                        users, options['concurrency'], server)
+                    violations.extend(
+                        self.report(scenario, results, elapsed, options))
+                    if scenario in ACCEPTED:
+                        accepted = UserTools.objects.filter(
+                            **ACCEPTED[scenario]).count()
+                        if accepted != len(users):
+                            violations.append('%s: %d of %d keys accepted'
+                                % (scenario, accepted, len(users)))
+            finally:
+                server.shutdown()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if violations:
+            raise CommandError('Budget exceeded:\n%s' % '\n'.join(violations))
+
+    def seed(self, count):
+        """
+        Creates ``count`` unverified users, each with a pending email change.
+
+        :return: A list of ``(username, verification_key, confirmation_key)``.
+        """
+        password = make_password(PASSWORD)
+        for chunk in chunked(range(count), SEED_CHUNK_SIZE):
+            User.objects.bulk_create([User(
+                username='%s%d' % (USERNAME_PREFIX, number),
+                email='%s%d@example.com' % (USERNAME_PREFIX, number),
+                password=password, is_active=False) for number in chunk])
+
+        created = now()
+        users = []
+        new_users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+        for chunk in chunked(new_users.iterator(), SEED_CHUNK_SIZE):
+            usertools = [UserTools(user=user,
+                verification_key=verification_key,
+                email_unconfirmed='new-%s' % user.email,
+                email_confirmation_key=confirmation_key,
+                email_confirmation_key_created=created)
+                for user, verification_key, confirmation_key in zip(chunk,
+                    generate_keys(chunk), generate_keys(chunk))]
+            UserTools.objects.bulk_create(usertools)
+            users.extend((each.user.username, each.verification_key,
+                each.email_confirmation_key) for each in usertools)
+        return users
+
+    def start_server(self):
+        server = LoadTestServer(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(QueryCountingApplication(
+            get_internal_wsgi_application()))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+    def run_scenario(self, request, users, concurrency, server):
+        """
+        Calls ``request`` once per user from ``concurrency`` threads.
+
+        :return:
+            A list of ``(seconds, queries, ok)`` per request and the wall
+            clock time of the whole run.
+        """
+        jobs = Queue.Queue()
+        for user in users:
+            jobs.put(user)
+        results = []
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                try:
+                    user = jobs.get_nowait()
+                except Queue.Empty:
+                    break
+                started = time.time()
+                try:
+                    queries, ok = request(user, server)
+                except Exception:
+                    queries, ok = 0, False
+                result = (time.time() - started, queries, ok)
+                with lock:
+                    results.append(result)
+            for connection in connections.all():
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(concurrency)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, time.time() - started
+
+    def fetch(self, server, path):
+        host, port = server.server_address[:2]
+        client = httplib.HTTPConnection(host, port)
+        try:
+            client.request('GET', path)
+            response = client.getresponse()
+            response.read()
+        finally:
+            client.close()
+        queries = int(response.getheader(QUERY_COUNT_HEADER, 0))
+        return queries, response.status < 400
+
+    def reverse(self, name, **kwargs):
+        try:
+            return reverse(name, kwargs=kwargs)
+        except NoReverseMatch:
+            raise CommandError('%s cannot be reversed, include usertools.urls '
+                'in ROOT_URLCONF.' % name)
+
+    def request_verify(self, user, server):
+        username, verification_key, confirmation_key = user
+        return self.fetch(server, self.reverse('usertools-verify',
+            verification_key=verification_key))
+
+    def request_confirm(self, user, server):
+        username, verification_key, confirmation_key = user
+        return self.fetch(server, self.reverse('usertools-email-confirm',
+            confirmation_key=confirmation_key))
+
+    def request_login(self, user, server):
+        username, verification_key, confirmation_key = user
+        before = count_queries()
+        authenticated = EmailAuthenticationBackend().authenticate(username,
+            password=PASSWORD)
+        return count_queries() - before, authenticated is not None
+
+    def report(self, scenario, results, elapsed, options):
+        """
+        Writes the statistics of a scenario.
+
+        :return: A list of budget violations.
+        """
+        latencies = [seconds * 1000 for seconds, queries, ok in results]
+        errors = len([ok for seconds, queries, ok in results if not ok])
+        queries = float(sum(q for seconds, q, ok in results)) / len(results)
+        stats = {
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'rps': len(results) / elapsed if elapsed else 0.0,
+            'queries': queries,
+        }
+        self.stdout.write('%s: %d requests, %d errors, %.1f req/s, '
+            'p50 %.1f ms, p99 %.1f ms, %.1f queries/request\n' % (
+            scenario, len(results), errors, stats['rps'], stats['p50'],
+            stats['p99'], stats['queries']))
+
+        violations = []
+        if errors:
+            violations.append('%s: %d requests failed' % (scenario, errors))
+        for name, budget, exceeded in (
+                ('p50', options['max_p50'], lambda v, b: v > b),
+                ('p99', options['max_p99'], lambda v, b: v > b),
+                ('rps', options['min_rps'], lambda v, b: v < b),
+                ('queries', options['max_queries'], lambda v, b: v > b)):
+            if budget is not None and exceeded(stats[name], budget):
+                violations.append('%s: %s is %.1f, budget %.1f'
+                    % (scenario, name, stats[name], budget))
+        return violations
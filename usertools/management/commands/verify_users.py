@@ -0,0 +1,87 @@
+###############################################################################
+## Import Python
+###############################################################################
+import sys
+from optparse import make_option
+
+
+###############################################################################
+## Import Django
+###############################################################################
+from django.core.management.base import BaseCommand, CommandError
+
+
+###############################################################################
+## Import User
+###############################################################################
+from usertools.management.reporting import REPORT_OPTIONS, Reporter
+from usertools.managers import BULK_CHUNK_SIZE
+from usertools.models import UserTools
+
+
+###############################################################################
+## Command
+###############################################################################
+class Command(BaseCommand):
+    """
+    Marks the email addresses of the users listed in a file as verified,
+    e.g. users migrated from a system where they were already verified.
+
+    The file has one user id per line. Blank lines and lines starting with
+    ``#`` are ignored. Use ``-`` to read from standard input.
+
+    """
+    option_list = BaseCommand.option_list + REPORT_OPTIONS + (
+        make_option('--activate',
+            action='store_true',
+            dest='activate',
+            default=False,
+            help='Also make the users active.'),
+        make_option('--chunk-size',
+            action='store',
+            type='int',
+            dest='chunk_size',
+            default=BULK_CHUNK_SIZE,
+            help='Number of users updated per statement.'),
+        )
+
+    args = '<file>'
+    help = 'Marks the email of the users with the ids in <file> as verified.'
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give exactly one file with user ids.')
+
+        if args[0] == '-':
+            id_file = sys.stdin
+        else:
+            try:
+                id_file = open(args[0])
+            except IOError as e:
+                raise CommandError('Cannot read %s: %s' % (args[0], e))
+
+        reporter = Reporter.from_options(self, options)
+        try:
+            verified = UserTools.objects.mark_verified_bulk(
+                self.read_ids(id_file),
+                activate=options['activate'],
+                chunk_size=options['chunk_size'],
+                progress=reporter.tick)
+            reporter.record('verified', "Verified %d user(s)." % verified,
+                count=verified)
+            reporter.finish()
+        finally:
+            reporter.close()
+            if id_file is not sys.stdin:
+                id_file.close()
+
+    def read_ids(self, id_file):
+        for number, line in enumerate(id_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                yield int(line)
+            except ValueError:
+                raise CommandError('Line %d is not a user id: %r'
+                    % (number, line))
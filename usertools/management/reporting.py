@@ -0,0 +1,116 @@
+###############################################################################
+## Imports
+###############################################################################
+# Python
+import json
+import time
+from optparse import make_option
+
+
+###############################################################################
+## Code
+###############################################################################
+REPORT_OPTIONS = (
+    make_option('--jsonl',
+        action='store',
+        dest='jsonl',
+        default=None,
+        help='Write the results as JSON lines to this file instead of stdout.'),
+    make_option('--progress-interval',
+        action='store',
+        type='float',
+        dest='progress_interval',
+        default=10.0,
+        help='Seconds between progress lines.'),
+    )
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+###############################################################################
+## Reporter
+###############################################################################
+class Reporter(object):
+    """
+    Streams the results of a maintenance command while it runs, so memory
+    use does not grow with the number of users.
+
+    Results go to stdout, or as JSON lines to a file. Progress lines with
+    the rate and, if the total is known, the ETA go to stderr every
+    ``interval`` seconds.
+    """
+    def __init__(self, stdout, stderr, jsonl=None, total=None, interval=10.0,
+                 verbose=True):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.jsonl = open(jsonl, 'w') if jsonl else None
+        self.interval = interval
+        self.verbose = verbose
+        self.start(total)
+
+    @classmethod
+    def from_options(cls, command, options, total=None, verbose=True):
+        """
+        Creates a reporter for ``command`` from its ``REPORT_OPTIONS``.
+        """
+        return cls(command.stdout, command.stderr, jsonl=options['jsonl'],
+            total=total, interval=options['progress_interval'],
+            verbose=verbose and int(options.get('verbosity', 1)) > 0)
+
+    def start(self, total=None):
+        """
+        Starts counting rows, e.g. for the next phase of a command.
+        """
+        self.total = total
+        self.done = 0
+        self.started = self.reported = time.time()
+
+    def record(self, kind, message, **data):
+        """
+        Writes one result: ``message`` on stdout, or ``data`` and ``kind`` as
+        a JSON line.
+        """
+        if self.jsonl is not None:
+            data['type'] = kind
+            self.jsonl.write(json.dumps(data) + '\n')
+        elif self.verbose:
+            self.stdout.write('%s\n' % message)
+
+    def tick(self, rows=1):
+        """
+        Counts ``rows`` processed rows and writes a progress line when due.
+        """
+        self.done += rows
+        if self.verbose and time.time() - self.reported >= self.interval:
+            self.reported = time.time()
+            self.stderr.write('%s\n' % self.progress())
+
+    def progress(self):
+        elapsed = time.time() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        line = '%d rows, %.1f rows/s' % (self.done, rate)
+        if self.total:
+            line = '%d/%d rows, %.1f rows/s' % (self.done, self.total, rate)
+            if rate:
+                line += ', ETA %s' % format_duration(
+                    max(self.total - self.done, 0) / rate)
+        return line
+
+    def finish(self):
+        """
+        Writes the final progress line of the rows counted since ``start``.
+        """
+        if self.verbose:
+            self.stderr.write('Done: %s in %s\n' % (self.progress(),
+                format_duration(time.time() - self.started)))
+
+    def close(self):
+        """
+        Closes the JSON lines file.
+        """
+        if self.jsonl is not None:
+            self.jsonl.close()
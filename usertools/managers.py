@@ -2,19 +2,28 @@
 ## Imports
 ###############################################################################
 # Python
+import itertools
 import re
+import time
+from datetime import timedelta
 
 # Django
 from django.contrib.auth.models import (User, Permission)
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
-from django.db import models
+from django.db import (connections, models, router, transaction,
+    DatabaseError)
+from django.db.models.query import QuerySet
+from django.utils.timezone import now
 
 # External
 from guardian.shortcuts import assign, get_perms
 
 # User
-from usertools.utils import get_profile_model, generate_hash
+from usertools import settings as usertools_settings
+from usertools.keys import generate_key
+from usertools.utils import (get_profile_model, chunked, chunked_pks,
+    get_read_database, iterate_by_pk, pin_to_primary, use_primary)
 from usertools import signals as usertools_signals
 
 
@@ -23,6 +32,12 @@ from usertools import signals as usertools_signals
 ###############################################################################
 SHA1_RE = re.compile('^[a-f0-9]{40}$')
 
+# Number of users handled per statement by the bulk operations.
+BULK_CHUNK_SIZE = 1000
+
+# User fields that identify a user case-insensitively at login.
+IDENTITY_FIELDS = ('email', 'username')
+
 ASSIGNED_PERMISSIONS = {
     'profile': (
         ('view_profile', 'Can view profile'),
@@ -63,6 +78,7 @@ class UserToolsManager(models.Manager):
 
         :return: :class:`User` instance representing the new user.
         """
+        pin_to_primary()
         new_user = User.objects.create_user(username, email, password)
         new_user.is_active = active
         new_user.save()
@@ -100,7 +116,7 @@ class UserToolsManager(models.Manager):
         :return: The newly created :class:`UserTools` instance.
 
         """
-        verification_key = generate_hash(user)
+        verification_key = generate_key(user)
         return self.create(user=user, verification_key=verification_key)
 
     def verify_email(self, verification_key):
@@ -120,18 +136,26 @@ class UserToolsManager(models.Manager):
 
         """
         if SHA1_RE.search(verification_key):
+            pin_to_primary()
             try:
-                usertools = self.get(verification_key=verification_key)
+                usertools = self.using(router.db_for_write(self.model))\
+                    .select_related('user')\
+                    .get(verification_key=verification_key)
             except self.model.DoesNotExist:
                 return False
 
             if (not usertools.verified
                     and not usertools.verification_key_expired()):
+                # Conditional update instead of a full save, so concurrent
+                # clicks on the same link verify (and signal) only once.
+                if not self.filter(pk=usertools.pk, verified=False)\
+                        .update(verified=True):
+                    return True
                 usertools.verified = True
-                usertools.save()
 
                 # Send the verification_complete signal
-                usertools_signals.verification_complete.send(sender=None,
+                usertools_signals.dispatch(
+                    usertools_signals.verification_complete,
                     instance=usertools)
                 return usertools
             return True
@@ -154,53 +178,425 @@ class UserToolsManager(models.Manager):
 
         """
         if SHA1_RE.search(confirmation_key):
+            pin_to_primary()
             try:
-                usertools = self.get(email_confirmation_key=confirmation_key,
-                                   email_unconfirmed__isnull=False)
+                usertools = self.using(router.db_for_write(self.model))\
+                    .select_related('user').get(
+                    email_confirmation_key=confirmation_key,
+                    email_unconfirmed__isnull=False)
             except self.model.DoesNotExist:
                 return False
             else:
                 user = usertools.user
                 old_email = user.email
+                if not self.filter(pk=usertools.pk,
+                        email_confirmation_key=confirmation_key)\
+                        .update(email_unconfirmed='', email_confirmation_key=''):
+                    return False
+                # The conditional update above guards against confirming
+                # twice; the user is saved normally so its save signals fire.
                 user.email = usertools.email_unconfirmed
                 usertools.email_unconfirmed, usertools.email_confirmation_key = '', ''
-                usertools.save()
                 user.save()
 
                 # Send the confirmation_complete signal
-                usertools_signals.confirmation_complete.send(sender=None,
+                usertools_signals.dispatch(
+                    usertools_signals.confirmation_complete,
                     instance=usertools, old_email=old_email)
 
                 return user
         return False
 
+    def mark_verified_bulk(self, users, activate=False,
+                           chunk_size=BULK_CHUNK_SIZE, progress=None):
+        """
+        Marks the email address of many users as verified, e.g. when importing
+        users that were already verified elsewhere.
+
+        Works in chunks of ``chunk_size`` users, each in its own transaction
+        and with a few set-based queries, whatever the number of users. Users
+        without a :class:`UserTools` get one. Instead of
+        ``verification_complete`` per user, sends one
+        ``verification_complete_batch`` signal per chunk.
+
+        :param users:
+            A :class:`User` queryset, paged by primary key, or an iterable
+            of user ids.
+
+        :param activate:
+            Boolean that defines if the users should also be made active.
+
+        :param chunk_size:
+            Number of users per chunk.
+
+        :param progress:
+            Optional callable, called with the number of users of each
+            chunk once it is done.
+
+        :return: The number of users that were newly verified.
+
+        """
+        if isinstance(users, QuerySet):
+            chunks = chunked_pks(users, chunk_size)
+        else:
+            chunks = chunked(users, chunk_size)
+
+        pin_to_primary()
+        verified = 0
+        for chunk in chunks:
+            with transaction.commit_on_success():
+                instances = self._mark_verified_chunk(chunk, activate)
+            # Sent once the chunk is committed, and even while signals are
+            # deferred, as a later error cannot roll the chunk back.
+            if instances:
+                verified += len(instances)
+                usertools_signals.dispatch(
+                    usertools_signals.verification_complete_batch,
+                    instances=self.filter(pk__in=instances))
+            usertools_signals.flush()
+            if progress is not None:
+                progress(len(chunk))
+        return verified
+
+    def _mark_verified_chunk(self, user_ids, activate):
+        """
+        Verifies the users with ``user_ids`` and returns the pks of their
+        newly verified :class:`UserTools`.
+        """
+        user_ids = set(User.objects.filter(pk__in=user_ids)
+            .values_list('pk', flat=True))
+        if not user_ids:
+            return []
+        existing = set(self.filter(user__in=user_ids)
+            .values_list('user', flat=True))
+        missing = user_ids - existing
+        pending = list(self.filter(user__in=existing, verified=False)
+            .values_list('pk', flat=True))
+
+        if pending:
+            self.filter(pk__in=pending).update(verified=True)
+        if missing:
+            self.bulk_create([self.model(user_id=pk, verified=True)
+                for pk in missing])
+        if activate:
+            User.objects.filter(pk__in=user_ids, is_active=False)\
+                .update(is_active=True)
+
+        if missing:
+            pending.extend(self.filter(user__in=missing)
+                .values_list('pk', flat=True))
+        return pending
+
+    def duplicate_identities(self, field):
+        """
+        Finds users whose ``field`` only differs in case, which makes
+        ``EmailAuthenticationBackend`` fail for all of them.
+
+        Runs a single ``GROUP BY LOWER(field)`` query joined back to the
+        users. On PostgreSQL the result is read through a server-side
+        cursor, so it is streamed instead of loaded at once; other backends
+        fetch it in chunks from their client-side cursor. Blank values are
+        ignored.
+
+        :param field:
+            ``'email'`` or ``'username'``.
+
+        :return:
+            A generator of ``(identity, [(user_id, value), ...])`` tuples,
+            ``identity`` being the lowercased value shared by the users.
+
+        """
+        if field not in IDENTITY_FIELDS:
+            raise ValueError('field must be one of %s' % ', '.join(IDENTITY_FIELDS))
+
+        connection = connections[get_read_database(User)
+            or router.db_for_read(User)]
+        qn = connection.ops.quote_name
+        table = qn(User._meta.db_table)
+        column = qn(User._meta.get_field(field).column)
+        cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            # psycopg2's default cursor fetches the whole result on execute,
+            # a named one keeps it on the server. ``withhold`` lets it
+            # outlive a commit, and work in autocommit mode.
+            cursor = connection.connection.cursor(
+                name='usertools_duplicate_%s' % field, withhold=True)
+        cursor.execute(
+            'SELECT u.%(pk)s, u.%(column)s, d.identity FROM %(table)s u '
+            'INNER JOIN (SELECT LOWER(%(column)s) AS identity FROM %(table)s '
+            'WHERE %(column)s <> %%s GROUP BY LOWER(%(column)s) '
+            'HAVING COUNT(*) > 1) d ON LOWER(u.%(column)s) = d.identity '
+            'ORDER BY d.identity, u.%(pk)s' % {
+                'pk': qn(User._meta.pk.column),
+                'column': column,
+                'table': table,
+            }, [''])
+
+        def rows():
+            try:
+                while True:
+                    fetched = cursor.fetchmany(BULK_CHUNK_SIZE)
+                    if not fetched:
+                        return
+                    for row in fetched:
+                        yield row
+            finally:
+                cursor.close()
+
+        for identity, group in itertools.groupby(rows(), lambda row: row[2]):
+            yield identity, [(row[0], row[1]) for row in group]
+
+    def create_identity_index(self, field):
+        """
+        Adds a unique index on ``LOWER(field)`` of the user table, so the
+        database refuses new users whose ``field`` only differs in case.
+        Blank values are left out of the index. Nothing is done if the index
+        already exists.
+
+        Supported on PostgreSQL, where the index is built without blocking
+        writes, and SQLite. Fails if duplicates exist. On PostgreSQL, an
+        invalid index left behind by a failed build is dropped, before
+        building it again and when the build fails.
+
+        :param field:
+            ``'email'`` or ``'username'``.
+
+        :return:
+            A tuple of the name of the index and ``True`` if it was created,
+            ``False`` if it already existed.
+
+        """
+        if field not in IDENTITY_FIELDS:
+            raise ValueError('field must be one of %s' % ', '.join(IDENTITY_FIELDS))
+
+        using = router.db_for_write(User)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        name = '%s_%s_lower_uniq' % (User._meta.db_table, field)
+        column = qn(User._meta.get_field(field).column)
+        sql = ("CREATE UNIQUE INDEX %%s %s ON %s (LOWER(%s)) WHERE %s <> ''"
+            % (qn(name), qn(User._meta.db_table), column, column))
+        cursor = connection.cursor()
+
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT i.indisvalid FROM pg_index i '
+                'INNER JOIN pg_class c ON c.oid = i.indexrelid '
+                'WHERE c.relname = %s', [name])
+            row = cursor.fetchone()
+            if row is not None and row[0]:
+                return name, False
+            # CONCURRENTLY cannot run inside a transaction.
+            transaction.commit_unless_managed(using=using)
+            level = connection.connection.isolation_level
+            connection.connection.set_isolation_level(0)
+            try:
+                if row is not None:
+                    cursor.execute('DROP INDEX %s' % qn(name))
+                try:
+                    cursor.execute(sql % 'CONCURRENTLY')
+                except DatabaseError:
+                    # A failed concurrent build leaves an invalid index.
+                    cursor.execute('DROP INDEX IF EXISTS %s' % qn(name))
+                    raise
+            finally:
+                connection.connection.set_isolation_level(level)
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master "
+                "WHERE type = 'index' AND name = %s", [name])
+            if cursor.fetchone() is not None:
+                return name, False
+            cursor.execute(sql % '')
+            transaction.commit_unless_managed(using=using)
+        else:
+            raise NotImplementedError('Case-insensitive unique indexes are '
+                'not supported on %s.' % connection.vendor)
+        return name, True
+
     def delete_expired_users(self):
         """
         Checks for expired users and delete's the ``User`` associated with
         it. Skips if the user ``is_staff``.
 
+        Keeps every deleted user in memory; use
+        ``iter_delete_expired_users`` for large user bases.
+
         :return: A list containing the deleted users.
 
         """
-        deleted_users = []
-        for user in User.objects.filter(is_staff=False):
-            if (not user.usertools.verified
-                    and user.usertools.verification_key_expired()):
-                deleted_users.append(user)
-                user.delete()
-        return deleted_users
+        return list(self.iter_delete_expired_users())
+
+    def iter_delete_expired_users(self, batch_size=BULK_CHUNK_SIZE):
+        """
+        Deletes the expired users like ``delete_expired_users``, reading them
+        ``batch_size`` at a time.
+
+        :return: A generator of the deleted users, deleting as it goes.
+
+        """
+        expired = User.objects.using(get_read_database(User)).filter(
+            is_staff=False, usertools__verified=False,
+            date_joined__lte=self.expiration_date())
+        for user in iterate_by_pk(expired, batch_size):
+            use_primary(user).delete()
+            yield user
+
+    def expiration_date(self):
+        """
+        Returns the date before which users must have joined for their
+        verification key to be expired.
+        """
+        return now() - timedelta(days=usertools_settings.VERIFICATION_DAYS)
+
+    def expired(self):
+        """
+        Returns the :class:`UserTools` of non-staff users that did not verify
+        their email address within ``VERIFICATION_DAYS``, as one queryset.
+        """
+        return self.filter(verified=False, user__is_staff=False,
+            user__date_joined__lte=self.expiration_date())
+
+    def expired_unarchived(self):
+        """
+        Returns the :class:`UserTools` of the expired users that
+        ``archive_expired_users`` has not archived yet.
+        """
+        expired_user_model = models.get_model('usertools', 'ExpiredUser')
+        return self.expired()\
+            .exclude(user__in=expired_user_model.objects.values('user_id'))
+
+    def archive_expired_users(self, batch_size=BULK_CHUNK_SIZE,
+                              progress=None):
+        """
+        Alternative to ``delete_expired_users`` that leaves the costly
+        deletion to ``purge_expired_users``.
+
+        Deactivates the expired users and copies their :class:`UserTools`
+        and main user fields to :class:`ExpiredUser`, ``batch_size`` users
+        per transaction, each batch with a fixed number of queries.
+
+        :param progress:
+            Optional callable, called with the number of users of each
+            batch once it is done.
+
+        :return: The number of archived users.
+
+        """
+        expired_user_model = models.get_model('usertools', 'ExpiredUser')
+        pending = self.expired_unarchived().order_by('user')
+        fields = ('user', 'user__username', 'user__email',
+            'user__first_name', 'user__last_name', 'user__date_joined',
+            'verification_key', 'email_unconfirmed')
+
+        pin_to_primary()
+        archived, last_user_id = 0, None
+        while True:
+            batch = pending
+            if last_user_id is not None:
+                batch = batch.filter(user__gt=last_user_id)
+            with transaction.commit_on_success():
+                rows = list(batch.values_list(*fields)[:batch_size])
+                if not rows:
+                    break
+                expired_user_model.objects.bulk_create([
+                    expired_user_model(**dict(zip(('user_id', 'username',
+                        'email', 'first_name', 'last_name', 'date_joined',
+                        'verification_key', 'email_unconfirmed'), row)))
+                    for row in rows])
+                user_ids = [row[0] for row in rows]
+                User.objects.filter(pk__in=user_ids).update(is_active=False)
+            usertools_signals.flush()
+            archived += len(rows)
+            last_user_id = user_ids[-1]
+            if progress is not None:
+                progress(len(rows))
+        return archived
+
+    def purge_expired_users(self, rows_per_second=None,
+                            batch_size=BULK_CHUNK_SIZE, progress=None):
+        """
+        Deletes the users archived by ``archive_expired_users``, in batches
+        of ``batch_size`` users per transaction.
+
+        Users that verified their email address or became staff since they
+        were archived are kept and their :class:`ExpiredUser` is removed.
+        Activation alone does not revive a user: like
+        ``delete_expired_users``, the purge deletes non-staff users that are
+        still unverified even if they were activated again.
+
+        :param rows_per_second:
+            Maximum number of users to delete per second, to limit the load
+            on a live database. Defaults to ``PURGE_ROWS_PER_SECOND``.
+
+        :param progress:
+            Optional callable, called with the number of archived users of
+            each batch once it is done.
+
+        :return: The number of deleted users.
+
+        """
+        if rows_per_second is None:
+            rows_per_second = usertools_settings.PURGE_ROWS_PER_SECOND
+        expired_user_model = models.get_model('usertools', 'ExpiredUser')
+        archived = expired_user_model.objects.filter(purged=False)\
+            .order_by('user_id')
+
+        pin_to_primary()
+        deleted = 0
+        while True:
+            started = time.time()
+            with transaction.commit_on_success():
+                user_ids = list(archived.values_list('user_id', flat=True)
+                    [:batch_size])
+                if not user_ids:
+                    break
+                doomed = list(User.objects.filter(pk__in=user_ids,
+                    is_staff=False, usertools__verified=False)
+                    .values_list('pk', flat=True))
+                revived = list(User.objects.filter(pk__in=user_ids)
+                    .exclude(pk__in=doomed).values_list('pk', flat=True))
+                User.objects.filter(pk__in=doomed).delete()
+                expired_user_model.objects.filter(user_id__in=revived).delete()
+                expired_user_model.objects.filter(user_id__in=user_ids)\
+                    .update(purged=True)
+            usertools_signals.flush()
+            deleted += len(doomed)
+            if progress is not None:
+                progress(len(user_ids))
+
+            if rows_per_second:
+                time.sleep(max(0, len(user_ids) / float(rows_per_second)
+                    - (time.time() - started)))
+        return deleted
 
     def check_permissions(self):
         """
         Checks that all permissions are set correctly for the users.
 
-        :return: A set of users whose permissions was wrong.
+        Keeps all results in memory; use ``iter_check_permissions`` for large
+        user bases.
+
+        :return:
+            A tuple of the added permissions, the users whose permissions
+            were wrong (each once) and warnings.
+        """
+        results = {'permission': [], 'changed': [], 'warning': []}
+        for kind, value in self.iter_check_permissions():
+            if kind in results:
+                results[kind].append(value)
+        return (results['permission'], results['changed'], results['warning'])
+
+    def iter_check_permissions(self, batch_size=BULK_CHUNK_SIZE):
         """
-        # Variable to supply some feedback
-        changed_permissions = []
-        changed_users = []
-        warnings = []
+        Checks that all permissions are set correctly for the users and fixes
+        them, reading the users ``batch_size`` at a time.
 
+        :return:
+            A generator of ``(kind, value)`` tuples, produced as the users
+            are checked: ``('permission', name)`` for each added permission,
+            ``('changed', user)`` once per user whose permissions were wrong,
+            ``('warning', message)``, and ``('checked', user)`` for every
+            checked user.
+        """
         # Check that all the permissions are available.
         for model, perms in ASSIGNED_PERMISSIONS.items():
             if model == 'profile':
@@ -213,22 +609,28 @@ class UserToolsManager(models.Manager):
                     Permission.objects.get(codename=perm[0],
                                            content_type=model_content_type)
                 except Permission.DoesNotExist:
-                    changed_permissions.append(perm[1])
                     Permission.objects.create(name=perm[1],
                                               codename=perm[0],
                                               content_type=model_content_type)
+                    yield ('permission', perm[1])
 
         # it is safe to rely on settings.ANONYMOUS_USER_ID since it is a
         # requirement of django-guardian
-        for user in User.objects.exclude(id=settings.ANONYMOUS_USER_ID):
+        users = User.objects.using(get_read_database(User))\
+            .exclude(id=settings.ANONYMOUS_USER_ID)
+        for user in iterate_by_pk(users, batch_size):
             try:
                 user_profile = user.get_profile()
             except get_profile_model().DoesNotExist:
-                warnings.append('No profile found for %s' % user)
+                yield ('warning', 'No profile found for %s' % user)
             else:
+                # Permissions are assigned on the primary.
+                use_primary(user)
+                use_primary(user_profile)
                 all_permissions = (get_perms(user, user_profile)
                     + get_perms(user, user))
 
+                changed = False
                 for model, perms in ASSIGNED_PERMISSIONS.items():
                     if model == 'profile':
                         perm_object = user.get_profile()
@@ -238,6 +640,7 @@ class UserToolsManager(models.Manager):
                     for perm in perms:
                         if perm[0] not in all_permissions:
                             assign(perm[0], user, perm_object)
-                            changed_users.append(user)
-
-        return (changed_permissions, changed_users, warnings)
+                            changed = True
+                if changed:
+                    yield ('changed', user)
+            yield ('checked', user)
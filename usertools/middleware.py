@@ -0,0 +1,54 @@
+###############################################################################
+## Imports
+###############################################################################
+# User
+from usertools import settings as usertools_settings
+from usertools import signals as usertools_signals
+from usertools.utils import unpin_primary, written_to_primary
+
+
+###############################################################################
+## Code
+###############################################################################
+PIN_COOKIE_NAME = 'usertools_primary'
+
+
+###############################################################################
+## Middleware
+###############################################################################
+class DeferredSignalsMiddleware(object):
+    """
+    Sends the usertools signals dispatched during a request only once the
+    request has been handled successfully.
+
+    Put it before ``django.middleware.transaction.TransactionMiddleware`` in
+    ``MIDDLEWARE_CLASSES``; its response is then processed after the
+    transaction has been committed, so receivers see the committed data.
+    Nothing is sent if the view raises, except for the signals of work
+    that was already committed on its own, see ``signals.deferred``.
+    """
+    def process_request(self, request):
+        usertools_signals.start_deferring()
+
+    def process_exception(self, request, exception):
+        usertools_signals.stop_deferring(send=False)
+
+    def process_response(self, request, response):
+        usertools_signals.stop_deferring()
+        return response
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Keeps the usertools reads of a client on the primary database for
+    ``USERTOOLS_REPLICA_PIN_SECONDS`` after a request of that client wrote,
+    so it does not see stale data while the replica catches up.
+    """
+    def process_request(self, request):
+        unpin_primary(from_cookie=PIN_COOKIE_NAME in request.COOKIES)
+
+    def process_response(self, request, response):
+        if written_to_primary():
+            response.set_cookie(PIN_COOKIE_NAME, '1',
+                max_age=usertools_settings.REPLICA_PIN_SECONDS)
+        return response
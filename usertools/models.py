@@ -10,13 +10,14 @@ from django.contrib.auth.models import User
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, send_mail
 from django.utils.timezone import now
 
 # User
 from usertools import settings as usertools_settings
 from usertools.managers import UserToolsManager
-from usertools.utils import generate_hash, get_user_model
+from usertools.keys import generate_key
+from usertools.utils import get_user_model, pin_to_primary
 
 
 ###############################################################################
@@ -39,14 +40,14 @@ class BaseProfile(models.Model):
 class UserTools(models.Model):
     user = models.OneToOneField(USER_MODEL)
     verification_key = models.CharField(max_length=40, null=True,
-        blank=True)
-    verified = models.BooleanField(default=False)
+        blank=True, db_index=True)
+    verified = models.BooleanField(default=False, db_index=True)
     email_unconfirmed = models.EmailField('unconfirmed email address',
-        null=True, blank=True,
+        null=True, blank=True, db_index=True,
         help_text='Temporary email address when the user requests an email change.')
     email_confirmation_key = models.CharField(
         'unconfirmed email verification key',
-        max_length=40, blank=True)
+        max_length=40, blank=True, db_index=True)
     email_confirmation_key_created = models.DateTimeField(
         'creation date of email confirmation key',
         null=True, blank=True)
@@ -69,18 +70,36 @@ class UserTools(models.Model):
         user has verified it by clicking on the verification URI in the email.
         This email gets send out by ``send_verification_email``.
 
+        A repeated request for the pending address within
+        ``EMAIL_CHANGE_COALESCE_SECONDS`` keeps the pending key and sends
+        no emails.
+
         :param email:
             The new email address that the user wants to use.
 
+        :return:
+            ``True`` if the confirmation emails were sent, ``False`` if the
+            request was coalesced with the pending one.
+
         """
+        coalesce = timedelta(
+            seconds=usertools_settings.EMAIL_CHANGE_COALESCE_SECONDS)
+        if (self.email_unconfirmed and self.email_confirmation_key
+                and self.email_unconfirmed.lower() == email.lower()
+                and self.email_confirmation_key_created
+                and now() - self.email_confirmation_key_created < coalesce):
+            return False
+
+        pin_to_primary()
         self.email_unconfirmed = email
 
-        self.email_confirmation_key = generate_hash(self.user)
+        self.email_confirmation_key = generate_key(self.user)
         self.email_confirmation_key_created = now()
         self.save()
 
         # Send email for confirmation
         self.send_confirmation_email()
+        return True
 
     def send_confirmation_email(self):
         """
@@ -136,12 +155,14 @@ class UserTools(models.Model):
             return True
         return False
 
-    def send_verification_email(self):
+    def get_verification_email(self):
         """
-        Sends a verification email to the user.
+        Builds the verification email for this user without sending it.
 
-        This email is sent when the user wants to verify the email
-        address on a new account.
+        Useful for sending many verification emails over a single
+        connection, e.g. with ``connection.send_messages()``.
+
+        :return: An :class:`EmailMessage` instance.
         """
         context = {'user': self.user,
                   'https': usertools_settings.USE_HTTPS,
@@ -154,5 +175,41 @@ class UserTools(models.Model):
         subject = ''.join(subject.splitlines())
         message = render_to_string('usertools/verification_email_message.txt',
             context)
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL,
+        return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL,
             [self.user.email])
+
+    def send_verification_email(self):
+        """
+        Sends a verification email to the user.
+
+        This email is sent when the user wants to verify the email
+        address on a new account.
+        """
+        self.get_verification_email().send()
+
+
+class ExpiredUser(models.Model):
+    """
+    Compact record of a user that did not verify the email address in time.
+
+    Archiving deactivates the user; the user is deleted later by
+    ``UserTools.objects.purge_expired_users``, which sets ``purged``, unless
+    the email address was verified in the meantime.
+    """
+    user_id = models.IntegerField(unique=True)
+    username = models.CharField(max_length=30)
+    email = models.EmailField(blank=True)
+    first_name = models.CharField(max_length=30, blank=True)
+    last_name = models.CharField(max_length=30, blank=True)
+    date_joined = models.DateTimeField()
+    verification_key = models.CharField(max_length=40, null=True, blank=True)
+    email_unconfirmed = models.EmailField(null=True, blank=True)
+    archived = models.DateTimeField(default=now)
+    purged = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        verbose_name = "Expired User"
+        verbose_name_plural = "Expired Users"
+
+    def __unicode__(self):
+        return '%s' % self.username
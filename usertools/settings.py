@@ -17,3 +17,51 @@ VERIFICATION_NOTIFY_DAYS = getattr(settings,
     'USERTOOLS_VERIFICATION_NOTIFY_DAYS', 5)
 
 USE_HTTPS = getattr(settings, 'USERTOOLS_USE_HTTPS', True)
+
+# Use table statistics instead of ``COUNT(*)`` for the unfiltered UserTools
+# changelist once the table is estimated to hold more rows than this.
+# ``None`` always uses an exact count.
+ADMIN_COUNT_ESTIMATE_THRESHOLD = getattr(settings,
+    'USERTOOLS_ADMIN_COUNT_ESTIMATE_THRESHOLD', None)
+# Maximum number of verification emails the admin action sends in one
+# request; they are rendered and sent while the page loads. ``None`` is
+# unlimited.
+ADMIN_RESEND_LIMIT = getattr(settings, 'USERTOOLS_ADMIN_RESEND_LIMIT', 500)
+
+# Database alias for usertools' read-only queries, e.g. a read replica.
+# ``None`` leaves routing to the project's database routers.
+READ_DATABASE = getattr(settings, 'USERTOOLS_READ_DATABASE', None)
+# Reads are sent to the primary for the rest of a request that wrote.
+# With ``ReplicaPinMiddleware`` installed, the client also keeps reading from
+# the primary for this many seconds after the request.
+REPLICA_PIN_SECONDS = getattr(settings, 'USERTOOLS_REPLICA_PIN_SECONDS', 10)
+
+# Load the UserTools and profile together with the user in the single query
+# ``EmailAuthenticationBackend.get_user`` runs for every request.
+LOAD_USER_RELATED = getattr(settings, 'USERTOOLS_LOAD_USER_RELATED', False)
+
+# What ``clean_expired`` does with expired unverified users: ``'delete'``
+# them, or ``'archive'`` them (deactivate and record in ``ExpiredUser``) for a
+# later, throttled purge.
+EXPIRY_MODE = getattr(settings, 'USERTOOLS_EXPIRY_MODE', 'delete')
+# Maximum number of users deleted per second by the purge. ``None`` is
+# unthrottled.
+PURGE_ROWS_PER_SECOND = getattr(settings,
+    'USERTOOLS_PURGE_ROWS_PER_SECOND', None)
+
+# Seconds during which repeating an email change to the same address reuses
+# the pending confirmation key and sends no new emails. ``0`` disables this.
+EMAIL_CHANGE_COALESCE_SECONDS = getattr(settings,
+    'USERTOOLS_EMAIL_CHANGE_COALESCE_SECONDS', 0)
+# Maximum number of email change requests per user in
+# ``EMAIL_CHANGE_RATE_PERIOD`` seconds, counted in the cache. ``None``
+# disables the limit.
+EMAIL_CHANGE_RATE_LIMIT = getattr(settings,
+    'USERTOOLS_EMAIL_CHANGE_RATE_LIMIT', None)
+EMAIL_CHANGE_RATE_PERIOD = getattr(settings,
+    'USERTOOLS_EMAIL_CHANGE_RATE_PERIOD', 3600)
+
+# How verification and confirmation keys are generated: ``'random'`` draws
+# them from the operating system's CSPRNG, ``'legacy'`` hashes the time, a
+# pseudo-random salt and the username. Both give 40 hex characters.
+KEY_FORMAT = getattr(settings, 'USERTOOLS_KEY_FORMAT', 'random')
@@ -1,7 +1,12 @@
 ###############################################################################
 ## Imports
 ###############################################################################
+# Python
+import threading
+from contextlib import contextmanager
+
 # Django
+from django.db import transaction
 from django.dispatch import Signal
 
 
@@ -10,3 +15,93 @@ from django.dispatch import Signal
 ###############################################################################
 verification_complete = Signal(providing_args=["instance", ])
 confirmation_complete = Signal(providing_args=["instance", "old_email"])
+
+# Sent once by bulk operations instead of ``verification_complete`` per user.
+# ``instances`` is a queryset of the affected ``UserTools``, so receivers can
+# act on all of them with a single query.
+verification_complete_batch = Signal(providing_args=["instances", ])
+
+
+###############################################################################
+## Dispatch
+###############################################################################
+_deferred = threading.local()
+
+
+def dispatch(signal, **kwargs):
+    """
+    Sends ``signal`` right away, or queues it if signals are being deferred
+    in this thread (see :func:`deferred`).
+    """
+    queue = getattr(_deferred, 'queue', None)
+    if queue is None:
+        return signal.send(sender=None, **kwargs)
+    queue.append((signal, kwargs))
+
+
+def start_deferring():
+    """
+    Starts queueing signals sent through :func:`dispatch` in this thread.
+    """
+    _deferred.queue = []
+
+
+def stop_deferring(send=True):
+    """
+    Stops queueing signals in this thread and, if ``send`` is ``True``,
+    sends the queued signals in the order they were dispatched.
+    """
+    queue = getattr(_deferred, 'queue', None) or []
+    _deferred.queue = None
+    if send:
+        for signal, kwargs in queue:
+            signal.send(sender=None, **kwargs)
+
+
+def flush():
+    """
+    Sends the signals queued so far in this thread, and keeps deferring.
+
+    Called after each commit by code that commits on its own, such as the
+    bulk operations of ``UserToolsManager``. On Django 1.4 such a commit
+    also commits the work of the signals queued before it, which a later
+    error can no longer roll back, so their signals must not be dropped.
+    """
+    queue = getattr(_deferred, 'queue', None)
+    if queue:
+        _deferred.queue = []
+        for signal, kwargs in queue:
+            signal.send(sender=None, **kwargs)
+
+
+@contextmanager
+def deferred(using=None):
+    """
+    Runs the block in a transaction and sends the usertools signals
+    dispatched inside it only after that transaction has been committed.
+    Nothing is sent if the block raises.
+
+    Code in the block that commits on its own (``mark_verified_bulk``,
+    ``archive_expired_users`` and ``purge_expired_users`` commit per batch)
+    sends the signals queued so far at each of its commits, see
+    :func:`flush`; those signals are sent even if the block raises later.
+
+    Nested blocks leave the signals to the outermost one.
+
+    :param using:
+        Database alias of the transaction. Defaults to the default database.
+
+    """
+    if getattr(_deferred, 'queue', None) is not None:
+        with transaction.commit_on_success(using=using):
+            yield
+        return
+
+    start_deferring()
+    try:
+        with transaction.commit_on_success(using=using):
+            yield
+    except:
+        stop_deferring(send=False)
+        raise
+    stop_deferring()
@@ -0,0 +1,634 @@
+###############################################################################
+## Imports
+###############################################################################
+# Python
+import time
+from datetime import timedelta
+
+# Django
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import reverse
+from django.core.signals import request_started
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.timezone import now
+
+# User
+from usertools import admin as usertools_admin
+from usertools import settings as usertools_settings
+from usertools import signals as usertools_signals
+from usertools.backends import EmailAuthenticationBackend
+from usertools.middleware import (PIN_COOKIE_NAME, DeferredSignalsMiddleware,
+    ReplicaPinMiddleware)
+from usertools.models import ExpiredUser, UserTools
+from usertools.forms import ChangeEmailForm
+from usertools.utils import (email_change_allowed, get_read_database,
+    pin_to_primary, unpin_primary)
+from usertools.views import get_backend_path
+
+
+###############################################################################
+## Code
+###############################################################################
+# The replica is a separate database that never receives the writes, so a
+# read that is routed to it cannot see them.
+PRIMARY = 'default'
+REPLICA = 'replica'
+
+
+def create_usertools(username, expired=False, **fields):
+    """
+    Creates a user with its :class:`UserTools`, which gets ``fields``.
+    ``expired`` backdates ``date_joined`` past ``VERIFICATION_DAYS``.
+    """
+    user = User.objects.create_user(username, '%s@example.com' % username,
+        'secret')
+    if expired:
+        user.date_joined = now() - timedelta(
+            days=usertools_settings.VERIFICATION_DAYS + 1)
+        user.save()
+    usertools = UserTools.objects.create_usertools(user)
+    if fields:
+        UserTools.objects.filter(pk=usertools.pk).update(**fields)
+        usertools = UserTools.objects.get(pk=usertools.pk)
+    return usertools
+
+
+class SubclassBackend(EmailAuthenticationBackend):
+    pass
+
+
+class SignalsMixin(object):
+    """
+    Records the usertools signals sent during a test in ``self.sent``.
+    """
+    def record_signals(self):
+        self.sent = []
+        for name in ('verification_complete', 'confirmation_complete',
+                     'verification_complete_batch'):
+            signal = getattr(usertools_signals, name)
+            receiver = self.make_receiver(name)
+            signal.connect(receiver, weak=False)
+            self.addCleanup(signal.disconnect, receiver)
+
+    def make_receiver(self, name):
+        def receiver(sender, **kwargs):
+            self.sent.append((name, kwargs))
+        return receiver
+
+    def sent_names(self):
+        return [name for name, kwargs in self.sent]
+
+
+class SettingsMixin(object):
+    """
+    Restores the usertools settings a test changed with ``set_setting``.
+    """
+    def set_setting(self, name, value):
+        if not hasattr(self, 'old_settings'):
+            self.old_settings = {}
+            self.addCleanup(self.restore_settings)
+        self.old_settings.setdefault(name,
+            getattr(usertools_settings, name))
+        setattr(usertools_settings, name, value)
+
+    def restore_settings(self):
+        for name, value in self.old_settings.items():
+            setattr(usertools_settings, name, value)
+
+
+###############################################################################
+## Tests
+###############################################################################
+class ReplicaTestCase(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.read_database = usertools_settings.READ_DATABASE
+        usertools_settings.READ_DATABASE = REPLICA
+        unpin_primary()
+        self.user = User.objects.create_user('john', 'john@example.com',
+            'secret')
+
+    def tearDown(self):
+        usertools_settings.READ_DATABASE = self.read_database
+        unpin_primary()
+
+    def authenticate(self):
+        return EmailAuthenticationBackend().authenticate('john',
+            check_password=False)
+
+
+class ReadRoutingTest(ReplicaTestCase):
+    def test_reads_go_to_replica(self):
+        self.assertEqual(get_read_database(User), REPLICA)
+        self.assertEqual(self.authenticate(), None)
+
+    def test_no_read_database_uses_routers(self):
+        usertools_settings.READ_DATABASE = None
+        self.assertEqual(get_read_database(User), None)
+        self.assertEqual(self.authenticate(), self.user)
+
+    def test_read_instance_saves_to_primary(self):
+        pin_to_primary()
+        user = self.authenticate()
+        self.assertEqual(user._state.db, PRIMARY)
+
+
+class PrimaryPinTest(ReplicaTestCase):
+    def test_write_pins_reads_to_primary(self):
+        usertools = UserTools.objects.create_usertools(self.user)
+        unpin_primary()
+        self.assertTrue(UserTools.objects.verify_email(
+            usertools.verification_key))
+        self.assertEqual(get_read_database(User), PRIMARY)
+        self.assertEqual(self.authenticate(), self.user)
+
+    def test_request_resets_pin(self):
+        pin_to_primary()
+        request_started.send(sender=self.__class__)
+        self.assertEqual(get_read_database(User), REPLICA)
+        self.assertEqual(self.authenticate(), None)
+
+
+class ReplicaPinMiddlewareTest(ReplicaTestCase):
+    def setUp(self):
+        super(ReplicaPinMiddlewareTest, self).setUp()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaPinMiddleware()
+
+    def process(self, request, write=False):
+        self.middleware.process_request(request)
+        if write:
+            pin_to_primary()
+        database = get_read_database(User)
+        response = self.middleware.process_response(request, HttpResponse())
+        return database, response
+
+    def test_write_sets_cookie(self):
+        database, response = self.process(self.factory.post('/'), write=True)
+        self.assertEqual(database, PRIMARY)
+        self.assertEqual(response.cookies[PIN_COOKIE_NAME]['max-age'],
+            usertools_settings.REPLICA_PIN_SECONDS)
+
+    def test_read_sets_no_cookie(self):
+        database, response = self.process(self.factory.get('/'))
+        self.assertEqual(database, REPLICA)
+        self.assertFalse(PIN_COOKIE_NAME in response.cookies)
+
+    def test_cookie_pins_next_request(self):
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE_NAME] = '1'
+        database, response = self.process(request)
+        self.assertEqual(database, PRIMARY)
+        self.assertFalse(PIN_COOKIE_NAME in response.cookies)
+
+        database, response = self.process(self.factory.get('/'))
+        self.assertEqual(database, REPLICA)
+
+
+class UserToolsAdminTest(SettingsMixin, TestCase):
+    urls = 'usertools.urls'
+
+    def setUp(self):
+        self.model_admin = usertools_admin.UserToolsAdmin(UserTools,
+            admin.site)
+        self.request = RequestFactory().post('/')
+        self.request._messages = CookieStorage(self.request)
+
+    def test_resend_skips_verified_and_expired(self):
+        create_usertools('pending')
+        create_usertools('verified', verified=True)
+        create_usertools('expired', expired=True)
+        self.model_admin.resend_verification(self.request,
+            UserTools.objects.all())
+        self.assertEqual([message.to for message in mail.outbox],
+            [['pending@example.com']])
+
+    def test_resend_limit(self):
+        self.set_setting('ADMIN_RESEND_LIMIT', 1)
+        create_usertools('first')
+        create_usertools('second')
+        self.model_admin.resend_verification(self.request,
+            UserTools.objects.all())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_mark_verified(self):
+        create_usertools('first')
+        create_usertools('second')
+        self.model_admin.mark_verified(self.request, UserTools.objects.all())
+        self.assertFalse(UserTools.objects.filter(verified=False).exists())
+
+    def test_clear_pending_email_change(self):
+        create_usertools('pending', email_unconfirmed='new@example.com',
+            email_confirmation_key='a' * 40,
+            email_confirmation_key_created=now())
+        self.model_admin.clear_pending_email_change(self.request,
+            UserTools.objects.all())
+        usertools = UserTools.objects.get()
+        self.assertEqual(usertools.email_unconfirmed, '')
+        self.assertEqual(usertools.email_confirmation_key, '')
+        self.assertEqual(usertools.email_confirmation_key_created, None)
+
+    def test_pending_email_change_filter(self):
+        pending = create_usertools('pending',
+            email_unconfirmed='new@example.com')
+        confirmed = create_usertools('confirmed', email_unconfirmed='')
+        new = create_usertools('new')
+
+        def filtered(value):
+            list_filter = usertools_admin.PendingEmailChangeFilter(
+                self.request, {'pending_email_change': value}, UserTools,
+                self.model_admin)
+            return set(list_filter.queryset(self.request,
+                UserTools.objects.all()))
+
+        self.assertEqual(filtered('yes'), set([pending]))
+        self.assertEqual(filtered('no'), set([confirmed, new]))
+
+    def test_count_estimate(self):
+        create_usertools('john')
+        estimate_count = usertools_admin.estimate_count
+        usertools_admin.estimate_count = lambda model, using: 1000
+        self.addCleanup(setattr, usertools_admin, 'estimate_count',
+            estimate_count)
+        queryset = self.model_admin.queryset(self.request)
+
+        self.assertEqual(queryset.count(), 1)
+        self.set_setting('ADMIN_COUNT_ESTIMATE_THRESHOLD', 100)
+        self.assertEqual(queryset.count(), 1000)
+        self.assertEqual(queryset.filter(verified=False).count(), 1)
+        self.set_setting('ADMIN_COUNT_ESTIMATE_THRESHOLD', 5000)
+        self.assertEqual(queryset.count(), 1)
+
+
+class ViewsTest(SignalsMixin, TestCase):
+    urls = 'usertools.urls'
+
+    def setUp(self):
+        self.usertools = create_usertools('john')
+        self.record_signals()
+
+    def verify(self):
+        return self.client.get(reverse('usertools-verify',
+            kwargs={'verification_key': self.usertools.verification_key}))
+
+    def test_verify_logs_user_in(self):
+        self.verify()
+        self.assertEqual(self.client.session[SESSION_KEY],
+            self.usertools.user.pk)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY],
+            'usertools.backends.EmailAuthenticationBackend')
+
+    def test_double_click_verifies_once(self):
+        self.verify()
+        self.verify()
+        self.assertTrue(UserTools.objects.get().verified)
+        self.assertEqual(self.sent_names(), ['verification_complete'])
+        self.assertFalse(SESSION_KEY in self.client.session)
+
+    def test_double_confirm(self):
+        self.usertools.change_email('new@example.com')
+        key = UserTools.objects.get().email_confirmation_key
+        user = UserTools.objects.confirm_email(key)
+        self.assertEqual(user.email, 'new@example.com')
+        self.assertEqual(User.objects.get().email, 'new@example.com')
+        self.assertEqual(UserTools.objects.confirm_email(key), False)
+        self.assertEqual(self.sent_names(), ['confirmation_complete'])
+
+    def test_confirm_view(self):
+        self.usertools.change_email('new@example.com')
+        path = reverse('usertools-email-confirm', kwargs={
+            'confirmation_key': UserTools.objects.get().email_confirmation_key})
+        self.assertRedirects(self.client.get(path),
+            settings.LOGIN_REDIRECT_URL, target_status_code=404)
+        self.assertRedirects(self.client.get(path), settings.LOGIN_URL,
+            target_status_code=404)
+
+    def test_backend_path(self):
+        backends = ('django.contrib.auth.backends.ModelBackend',
+            'usertools.tests.SubclassBackend')
+        with self.settings(AUTHENTICATION_BACKENDS=backends):
+            self.assertEqual(get_backend_path(), backends[1])
+            self.verify()
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY],
+            backends[1])
+        with self.settings(AUTHENTICATION_BACKENDS=backends[:1]):
+            self.assertRaises(ImproperlyConfigured, get_backend_path)
+
+
+class DeferredSignalsTest(SignalsMixin, TestCase):
+    def setUp(self):
+        self.record_signals()
+        self.addCleanup(usertools_signals.stop_deferring, send=False)
+
+    def dispatch(self, name, **kwargs):
+        usertools_signals.dispatch(getattr(usertools_signals, name), **kwargs)
+
+    def test_immediate_without_deferring(self):
+        self.dispatch('verification_complete', instance=1)
+        self.assertEqual(self.sent_names(), ['verification_complete'])
+
+    def test_sent_in_order_after_block(self):
+        with usertools_signals.deferred():
+            self.dispatch('verification_complete', instance=1)
+            self.dispatch('confirmation_complete', instance=2, old_email='')
+            self.dispatch('verification_complete', instance=3)
+            self.assertEqual(self.sent, [])
+        self.assertEqual([kwargs['instance'] for name, kwargs in self.sent],
+            [1, 2, 3])
+        self.assertEqual(self.sent_names(), ['verification_complete',
+            'confirmation_complete', 'verification_complete'])
+
+    def test_nested_blocks_send_at_outermost(self):
+        with usertools_signals.deferred():
+            with usertools_signals.deferred():
+                self.dispatch('verification_complete', instance=1)
+            self.assertEqual(self.sent, [])
+        self.assertEqual(self.sent_names(), ['verification_complete'])
+
+    def test_discarded_on_error(self):
+        try:
+            with usertools_signals.deferred():
+                self.dispatch('verification_complete', instance=1)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.sent, [])
+        # Deferring stopped with the block.
+        self.dispatch('verification_complete', instance=2)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_flush_sends_committed_signals(self):
+        try:
+            with usertools_signals.deferred():
+                self.dispatch('verification_complete', instance=1)
+                usertools_signals.flush()
+                self.assertEqual(len(self.sent), 1)
+                self.dispatch('verification_complete', instance=2)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual([kwargs['instance'] for name, kwargs in self.sent],
+            [1])
+
+    def test_middleware(self):
+        middleware = DeferredSignalsMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.dispatch('verification_complete', instance=1)
+        self.assertEqual(self.sent, [])
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(self.sent_names(), ['verification_complete'])
+
+    def test_middleware_discards_on_exception(self):
+        middleware = DeferredSignalsMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.dispatch('verification_complete', instance=1)
+        middleware.process_exception(request, ValueError())
+        middleware.process_response(request, HttpResponse())
+        self.assertEqual(self.sent, [])
+
+
+class MarkVerifiedBulkTest(SignalsMixin, TestCase):
+    def setUp(self):
+        self.user_ids = [create_usertools('user%d' % number).user.pk
+            for number in range(5)]
+        self.record_signals()
+
+    def batches(self):
+        return [set(kwargs['instances'].values_list('user', flat=True))
+            for name, kwargs in self.sent
+            if name == 'verification_complete_batch']
+
+    def test_one_signal_per_chunk(self):
+        verified = UserTools.objects.mark_verified_bulk(self.user_ids,
+            chunk_size=2)
+        self.assertEqual(verified, 5)
+        self.assertEqual(self.batches(), [set(self.user_ids[:2]),
+            set(self.user_ids[2:4]), set(self.user_ids[4:])])
+        self.assertFalse(UserTools.objects.filter(verified=False).exists())
+
+    def test_queryset(self):
+        verified = UserTools.objects.mark_verified_bulk(
+            User.objects.filter(pk__in=self.user_ids), chunk_size=3)
+        self.assertEqual(verified, 5)
+        self.assertEqual(self.batches(), [set(self.user_ids[:3]),
+            set(self.user_ids[3:])])
+
+    def test_skips_verified_and_unknown_users(self):
+        UserTools.objects.filter(user=self.user_ids[0]).update(verified=True)
+        unknown = max(self.user_ids) + 100
+        verified = UserTools.objects.mark_verified_bulk(
+            self.user_ids + [unknown])
+        self.assertEqual(verified, 4)
+        self.assertEqual(self.batches(), [set(self.user_ids[1:])])
+        self.assertEqual(UserTools.objects.mark_verified_bulk([unknown]), 0)
+        self.assertEqual(len(self.batches()), 1)
+
+    def test_creates_missing_usertools(self):
+        user = User.objects.create_user('bare', 'bare@example.com', 'secret')
+        self.assertEqual(UserTools.objects.mark_verified_bulk([user.pk]), 1)
+        self.assertTrue(UserTools.objects.get(user=user).verified)
+        self.assertEqual(self.batches(), [set([user.pk])])
+
+    def test_activate(self):
+        User.objects.filter(pk__in=self.user_ids).update(is_active=False)
+        UserTools.objects.mark_verified_bulk(self.user_ids[:2])
+        UserTools.objects.mark_verified_bulk(self.user_ids[2:], activate=True)
+        self.assertEqual(set(User.objects.filter(is_active=True)
+            .values_list('pk', flat=True)), set(self.user_ids[2:]))
+
+    def test_signals_of_committed_chunks_survive_error(self):
+        try:
+            with usertools_signals.deferred():
+                UserTools.objects.mark_verified_bulk(self.user_ids,
+                    chunk_size=2)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(len(self.batches()), 3)
+
+
+class IdentityTest(TestCase):
+    def test_duplicate_identities(self):
+        first = User.objects.create_user('john', 'John@example.com', 'secret')
+        second = User.objects.create_user('john2', 'john@example.com', 'x')
+        User.objects.create_user('jane', 'jane@example.com', 'secret')
+        self.assertEqual(list(UserTools.objects.duplicate_identities('email')),
+            [('john@example.com', [(first.pk, 'John@example.com'),
+                (second.pk, 'john@example.com')])])
+
+    def test_create_identity_index_twice(self):
+        name, created = UserTools.objects.create_identity_index('email')
+        self.assertTrue(created)
+        self.assertEqual(UserTools.objects.create_identity_index('email'),
+            (name, False))
+
+
+class ExpiryTest(SettingsMixin, TestCase):
+    def setUp(self):
+        self.expired = [create_usertools('expired%d' % number, expired=True)
+            .user for number in range(5)]
+        create_usertools('fresh')
+        create_usertools('verified', expired=True, verified=True)
+        staff = create_usertools('staff', expired=True).user
+        staff.is_staff = True
+        staff.save()
+
+    def test_archive(self):
+        batches = []
+        self.assertEqual(UserTools.objects.archive_expired_users(
+            batch_size=2, progress=batches.append), 5)
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(set(ExpiredUser.objects.values_list('user_id',
+            flat=True)), set(user.pk for user in self.expired))
+        self.assertFalse(User.objects.filter(pk__in=self.expired,
+            is_active=True).exists())
+        self.assertEqual(UserTools.objects.expired_unarchived().count(), 0)
+        self.assertEqual(UserTools.objects.archive_expired_users(), 0)
+
+    def test_archive_user_with_pk_zero(self):
+        # After guardian's anonymous user -1, SQLite gives the first user
+        # pk 0 anyway.
+        if not User.objects.filter(pk=0).exists():
+            user = User.objects.create(pk=0, username='zero',
+                date_joined=self.expired[0].date_joined)
+            UserTools.objects.create_usertools(user)
+        UserTools.objects.archive_expired_users(batch_size=1)
+        self.assertTrue(ExpiredUser.objects.filter(user_id=0).exists())
+        self.assertEqual(UserTools.objects.expired_unarchived().count(), 0)
+
+    def test_purge(self):
+        UserTools.objects.archive_expired_users()
+        verified, staff, reactivated = self.expired[:3]
+        UserTools.objects.filter(user=verified).update(verified=True)
+        User.objects.filter(pk=staff.pk).update(is_staff=True)
+        User.objects.filter(pk=reactivated.pk).update(is_active=True)
+
+        self.assertEqual(UserTools.objects.purge_expired_users(batch_size=2),
+            3)
+        self.assertEqual(set(User.objects.filter(pk__in=self.expired)
+            .values_list('pk', flat=True)), set([verified.pk, staff.pk]))
+        # Revived users lose their archive, the others keep it as purged.
+        self.assertEqual(set(ExpiredUser.objects.values_list('user_id',
+            flat=True)), set(user.pk for user in self.expired[2:]))
+        self.assertFalse(ExpiredUser.objects.filter(purged=False).exists())
+
+        self.assertEqual(UserTools.objects.archive_expired_users(), 0)
+        self.assertEqual(UserTools.objects.purge_expired_users(), 0)
+
+    def record_sleeps(self):
+        sleeps = []
+        sleep = time.sleep
+        time.sleep = sleeps.append
+        self.addCleanup(setattr, time, 'sleep', sleep)
+        return sleeps
+
+    def test_purge_throttle(self):
+        self.set_setting('PURGE_ROWS_PER_SECOND', 10)
+        UserTools.objects.archive_expired_users()
+        sleeps = self.record_sleeps()
+        UserTools.objects.purge_expired_users(batch_size=2)
+        self.assertEqual(len(sleeps), 3)
+        for seconds, rows in zip(sleeps, [2, 2, 1]):
+            self.assertTrue(0 <= seconds <= rows / 10.0)
+
+    def test_purge_unthrottled(self):
+        self.set_setting('PURGE_ROWS_PER_SECOND', None)
+        UserTools.objects.archive_expired_users()
+        sleeps = self.record_sleeps()
+        self.assertEqual(UserTools.objects.purge_expired_users(batch_size=2),
+            5)
+        self.assertEqual(sleeps, [])
+
+
+class EmailChangeTest(SettingsMixin, TestCase):
+    urls = 'usertools.urls'
+
+    def setUp(self):
+        self.usertools = create_usertools('john')
+        self.set_setting('EMAIL_CHANGE_COALESCE_SECONDS', 60)
+
+    def reload(self):
+        self.usertools = UserTools.objects.get(pk=self.usertools.pk)
+        return self.usertools
+
+    def test_change_sends_emails(self):
+        self.assertTrue(self.usertools.change_email('new@example.com'))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.reload().email_unconfirmed, 'new@example.com')
+
+    def test_repeat_is_coalesced(self):
+        self.usertools.change_email('new@example.com')
+        key = self.reload().email_confirmation_key
+        self.assertFalse(self.usertools.change_email('NEW@example.com'))
+        self.assertEqual(self.reload().email_confirmation_key, key)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_other_address_is_not_coalesced(self):
+        self.usertools.change_email('new@example.com')
+        key = self.reload().email_confirmation_key
+        self.assertTrue(self.usertools.change_email('other@example.com'))
+        self.assertNotEqual(self.reload().email_confirmation_key, key)
+        self.assertEqual(self.usertools.email_unconfirmed,
+            'other@example.com')
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_repeat_after_window(self):
+        self.usertools.change_email('new@example.com')
+        UserTools.objects.filter(pk=self.usertools.pk).update(
+            email_confirmation_key_created=now() - timedelta(seconds=61))
+        self.assertTrue(self.reload().change_email('new@example.com'))
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_coalescing_disabled(self):
+        self.set_setting('EMAIL_CHANGE_COALESCE_SECONDS', 0)
+        self.usertools.change_email('new@example.com')
+        self.assertTrue(self.reload().change_email('new@example.com'))
+        self.assertEqual(len(mail.outbox), 4)
+
+
+class EmailChangeRateLimitTest(SettingsMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('john', 'john@example.com',
+            'secret')
+        self.set_setting('EMAIL_CHANGE_RATE_LIMIT', 2)
+
+    def test_no_limit(self):
+        self.set_setting('EMAIL_CHANGE_RATE_LIMIT', None)
+        for attempt in range(5):
+            self.assertTrue(email_change_allowed(self.user))
+
+    def test_limit_per_user(self):
+        other = User.objects.create_user('jane', 'jane@example.com', 'secret')
+        self.assertTrue(email_change_allowed(self.user))
+        self.assertTrue(email_change_allowed(self.user))
+        self.assertFalse(email_change_allowed(self.user))
+        self.assertTrue(email_change_allowed(other))
+
+    def test_counter_expired_after_add(self):
+        # ``add`` finds the counter that expires before ``incr`` runs.
+        cache.add = lambda *args, **kwargs: False
+        self.addCleanup(delattr, cache, 'add')
+        self.assertTrue(email_change_allowed(self.user))
+        self.assertEqual(cache.get('usertools:email-change:%s'
+            % self.user.pk), 1)
+
+    def test_form(self):
+        data = {'email': 'new@example.com'}
+        self.assertTrue(ChangeEmailForm(self.user, data).is_valid())
+        self.assertTrue(ChangeEmailForm(self.user, data).is_valid())
+        form = ChangeEmailForm(self.user, data)
+        self.assertFalse(form.is_valid())
+        self.assertTrue('email' in form.errors)
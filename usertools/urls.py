@@ -16,9 +16,5 @@ urlpatterns = patterns('',
         usertools_views.EmailVerify.as_view(), name='usertools-verify'),
 
     url(r'^confirm-email/(?P<confirmation_key>\w+)/$',
-        usertools_views.email_confirm,
-        {'success_url': 'email_confirm_complete',
-        'template_name': 'desktop/pages/email_confirm_fail.html',
-        'extra_context': {'layout': layout}},
-        name='usertools-email-confirm'),
+        usertools_views.EmailConfirm.as_view(), name='usertools-email-confirm'),
 )
@@ -4,15 +4,22 @@
 # Python
 import hashlib
 import random
+import threading
 
 # Django
 from django.conf import settings
 from django.contrib.auth.models import SiteProfileNotAvailable
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_finished, request_started
+from django.db import router
 from django.db.models import get_model
 from django.utils.decorators import method_decorator
 from django.utils.timezone import now
 
+# User
+from usertools import settings as usertools_settings
+
 
 ###############################################################################
 ## Utils
@@ -53,6 +60,83 @@ def get_user_model():
     return user_model
 
 
+def chunked(iterable, size):
+    """
+    Yields lists of up to ``size`` items from ``iterable`` without
+    materialising it.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def email_change_allowed(user):
+    """
+    Counts an email change request of ``user`` and returns ``False`` if the
+    user made more than ``EMAIL_CHANGE_RATE_LIMIT`` of them in the last
+    ``EMAIL_CHANGE_RATE_PERIOD`` seconds. Only the cache is used.
+    """
+    limit = usertools_settings.EMAIL_CHANGE_RATE_LIMIT
+    if limit is None:
+        return True
+
+    key = 'usertools:email-change:%s' % user.pk
+    period = usertools_settings.EMAIL_CHANGE_RATE_PERIOD
+    cache.add(key, 0, period)
+    try:
+        attempts = cache.incr(key)
+    except ValueError:
+        # The counter expired between ``add`` and ``incr``.
+        cache.set(key, 1, period)
+        attempts = 1
+    return attempts <= limit
+
+
+def iterate_by_pk(queryset, batch_size):
+    """
+    Iterates over ``queryset`` in primary key order, loading ``batch_size``
+    objects per query. Unlike ``iterator()``, memory use does not depend on
+    the size of the result on any database backend.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        for obj in batch:
+            yield obj
+
+
+def chunked_pks(queryset, size):
+    """
+    Yields the primary keys of ``queryset`` in lists of up to ``size``, one
+    query per list. Pages by primary key like :func:`iterate_by_pk`, so no
+    cursor stays open between the lists, e.g. while each list is handled
+    in its own transaction.
+    """
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:size])
+        if not chunk:
+            return
+        last_pk = chunk[-1]
+        yield chunk
+
+
 def generate_hash(user):
     salt = hashlib.sha1(str(random.random())).hexdigest()[:5]
     username = user.username
@@ -63,6 +147,74 @@ def generate_hash(user):
         salt, username)).hexdigest()
 
 
+###############################################################################
+## Database Routing
+###############################################################################
+_primary = threading.local()
+
+
+def pin_to_primary():
+    """
+    Sends the usertools reads of this thread to the primary database, so they
+    see the writes that were just made. The pin is reset when a request
+    starts or finishes; outside of requests it lasts until
+    :func:`unpin_primary` is called.
+    """
+    _primary.written = True
+
+
+def unpin_primary(from_cookie=False):
+    """
+    Resets the primary pin of this thread. ``from_cookie`` keeps the reads on
+    the primary for a client that wrote in a recent request.
+    """
+    _primary.written = False
+    _primary.from_cookie = from_cookie
+
+
+def reset_primary_pin(sender, **kwargs):
+    """
+    Scopes the primary pin to a single request, whether or not
+    ``ReplicaPinMiddleware`` is installed.
+    """
+    unpin_primary()
+
+request_started.connect(reset_primary_pin,
+    dispatch_uid='usertools.utils.reset_primary_pin')
+request_finished.connect(reset_primary_pin,
+    dispatch_uid='usertools.utils.reset_primary_pin')
+
+
+def written_to_primary():
+    """
+    Returns ``True`` if a usertools write happened since the last reset.
+    """
+    return getattr(_primary, 'written', False)
+
+
+def get_read_database(model):
+    """
+    Returns the database alias for a read-only query on ``model``.
+
+    This is ``USERTOOLS_READ_DATABASE``, unless this thread is pinned to the
+    primary, in which case it is the database ``model`` is written to.
+    ``None`` leaves the choice to the database routers.
+    """
+    if written_to_primary() or getattr(_primary, 'from_cookie', False):
+        return router.db_for_write(model)
+    return usertools_settings.READ_DATABASE
+
+
+def use_primary(instance):
+    """
+    Points an ``instance`` that was read from the replica back at its write
+    database. Without this, saving or deleting it would go to the replica.
+    """
+    if instance is not None:
+        instance._state.db = router.db_for_write(instance.__class__)
+    return instance
+
+
 ###############################################################################
 ## Decorators
 ###############################################################################
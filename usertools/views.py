@@ -3,17 +3,35 @@
 ###############################################################################
 # Django
 from django.shortcuts import redirect
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import load_backend, login, logout
+from django.core.exceptions import ImproperlyConfigured
 from django.views.generic import View
 from django.conf import settings
 from django.contrib import messages
 from django.views.decorators.cache import never_cache
 
 # User
+from usertools.backends import EmailAuthenticationBackend
 from usertools.models import UserTools
 from usertools.utils import class_view_decorator
 
 
+###############################################################################
+## Code
+###############################################################################
+def get_backend_path():
+    """
+    Returns the path of the first backend in ``AUTHENTICATION_BACKENDS``
+    that is an :class:`EmailAuthenticationBackend`, so a project's subclass
+    signs in the verified users.
+    """
+    for path in settings.AUTHENTICATION_BACKENDS:
+        if isinstance(load_backend(path), EmailAuthenticationBackend):
+            return path
+    raise ImproperlyConfigured('AUTHENTICATION_BACKENDS must include '
+        'usertools.backends.EmailAuthenticationBackend or a subclass.')
+
+
 ###############################################################################
 ## Views
 ###############################################################################
@@ -35,9 +53,10 @@ class EmailVerify(View):
                     'Your account has already been verified. Please login to continue.')
                 return redirect(self.redirect_failure)
 
-            # Else: Sign the user in.
-            auth_user = authenticate(identification=usertools.user.username,
-                                     check_password=False)
+            # Else: Sign the user in. The user is already loaded with the
+            # usertools, so skip the extra lookup done by ``authenticate``.
+            auth_user = usertools.user
+            auth_user.backend = get_backend_path()
             login(request, auth_user)
 
             messages.info(request,